@@ -0,0 +1,183 @@
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from ratelimit import TokenBucket
+
+
+class AdmissionRejected(Exception):
+    """The request was not admitted; retry_after is a hint in whole seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.granted = threading.Event()
+        self.enqueued_at = time.monotonic()
+
+
+class AdmissionController:
+    """
+    Gatekeeper for the LLM-backed endpoints.
+
+    Each user has a token bucket (requests per minute with a burst) and a cap
+    on concurrent requests. At most max_concurrent requests run in total;
+    the rest wait in a bounded queue that is drained round-robin across users,
+    so one user with many queued requests cannot starve the others. When the
+    queue is full, or a request waits longer than queue_timeout, it is
+    rejected right away instead of tying up a worker, and its rate token is
+    given back.
+
+    All state lives in this process: with several workers, each one applies
+    the limits and runs its own queue.
+    """
+
+    def __init__(self, max_concurrent=8, per_user_concurrency=2, per_user_rate_per_minute=20,
+                 per_user_burst=5, max_queue=64, queue_timeout=30, max_tracked_users=10000,
+                 metrics=None):
+        self.max_concurrent = max_concurrent
+        self.per_user_concurrency = per_user_concurrency
+        self.per_user_rate = per_user_rate_per_minute / 60.0
+        self.per_user_burst = per_user_burst
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_tracked_users = max_tracked_users
+        self.metrics = metrics
+
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self._active = 0
+        self._active_by_user = {}
+        # user_id -> deque of waiting tickets; key order is the round-robin order
+        self._waiting = OrderedDict()
+        self._queued = 0
+        # Moving average of how long an admitted request holds its slot
+        self._avg_service = 1.0
+
+    @contextmanager
+    def admit(self, user_id):
+        """Hold a slot for the duration of the with block, or raise AdmissionRejected."""
+        bucket = self._take_token(user_id)
+        try:
+            self._enter(user_id)
+        except AdmissionRejected:
+            # Nothing ran, so a retry after Retry-After must not find the budget spent
+            bucket.refund()
+            raise
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._leave(user_id, time.monotonic() - started)
+
+    def _take_token(self, user_id):
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = self._buckets[user_id] = TokenBucket(self.per_user_rate, self.per_user_burst)
+                while len(self._buckets) > self.max_tracked_users:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(user_id)
+        acquired, wait = bucket.try_acquire()
+        if not acquired:
+            self._incr("rejected.rate_limited")
+            raise AdmissionRejected("rate limit exceeded", max(1, math.ceil(wait)))
+        return bucket
+
+    def _enter(self, user_id):
+        with self._lock:
+            if not self._queued and self._can_run(user_id):
+                self._start(user_id)
+                self._observe_wait(0.0)
+                return
+            if self._queued >= self.max_queue:
+                self._incr("rejected.queue_full")
+                raise AdmissionRejected("server busy", self._estimate_wait())
+            ticket = _Ticket(user_id)
+            self._waiting.setdefault(user_id, deque()).append(ticket)
+            self._queued += 1
+            self._gauges()
+            # A slot may be free for this user even though others are queued
+            self._dispatch()
+
+        if ticket.granted.wait(self.queue_timeout):
+            self._observe_wait(time.monotonic() - ticket.enqueued_at)
+            return
+
+        with self._lock:
+            if ticket.granted.is_set():
+                # Granted between the timeout and taking the lock
+                self._observe_wait(time.monotonic() - ticket.enqueued_at)
+                return
+            queue = self._waiting.get(user_id)
+            queue.remove(ticket)
+            if not queue:
+                del self._waiting[user_id]
+            self._queued -= 1
+            self._gauges()
+        self._incr("rejected.timeout")
+        raise AdmissionRejected("timed out waiting in queue", self._estimate_wait())
+
+    def _leave(self, user_id, service_time):
+        with self._lock:
+            self._avg_service = 0.9 * self._avg_service + 0.1 * service_time
+            self._active -= 1
+            remaining = self._active_by_user[user_id] - 1
+            if remaining:
+                self._active_by_user[user_id] = remaining
+            else:
+                del self._active_by_user[user_id]
+            self._dispatch()
+            self._gauges()
+
+    def _can_run(self, user_id):
+        return (self._active < self.max_concurrent
+                and self._active_by_user.get(user_id, 0) < self.per_user_concurrency)
+
+    def _start(self, user_id):
+        self._active += 1
+        self._active_by_user[user_id] = self._active_by_user.get(user_id, 0) + 1
+        self._gauges()
+
+    def _dispatch(self):
+        """Grant free slots round-robin to users with waiting tickets. Caller holds the lock."""
+        skipped = 0
+        while self._waiting and self._active < self.max_concurrent and skipped < len(self._waiting):
+            user_id, queue = next(iter(self._waiting.items()))
+            # Whoever we look at goes to the back of the rotation
+            self._waiting.move_to_end(user_id)
+            if not self._can_run(user_id):
+                skipped += 1
+                continue
+            skipped = 0
+            ticket = queue.popleft()
+            if not queue:
+                del self._waiting[user_id]
+            self._queued -= 1
+            self._start(user_id)
+            ticket.granted.set()
+
+    def _estimate_wait(self):
+        return max(1, math.ceil(self._avg_service * (self._queued + 1) / self.max_concurrent))
+
+    def _gauges(self):
+        if self.metrics:
+            self.metrics.gauge("admission.active", self._active)
+            self.metrics.gauge("admission.queue_depth", self._queued)
+            self.metrics.gauge("admission.queued_users", len(self._waiting))
+
+    def _observe_wait(self, seconds):
+        if self.metrics:
+            self.metrics.observe("admission.wait", seconds)
+            self.metrics.incr("admission.admitted")
+
+    def _incr(self, name):
+        if self.metrics:
+            self.metrics.incr(f"admission.{name}")
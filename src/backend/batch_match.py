@@ -0,0 +1,257 @@
+"""
+Push a JSONL file of dilemmas through the same matching pipeline as
+/api/discussions/match/.
+
+    python batch_match.py dilemmas.jsonl --output results.jsonl
+    python batch_match.py dilemmas.jsonl --output s3://philo-ai/batch/run-1/ --persist
+
+Each input line is either a match request body ({"user_id", "discussionId",
+"messages": [...]}) or a plain {"id", "text"} record. Records are processed by
+a bounded thread pool under a shared OpenAI requests-per-minute budget, and
+every finished record id is appended to a checkpoint file so a rerun skips
+work that is already done. Records that fail for transient reasons (OpenAI
+errors) are reported on stderr and left out of both the output and the
+checkpoint, so the next run retries them and the output holds one row per id.
+
+Only matching.py is imported from the web app, so no background threads or
+health probes run alongside the batch and every OpenAI call goes through the
+--rpm budget.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+from cache import create_user_cache
+from matching import MatchError, build_match_discussion, dilemma_from_request, match_philosopher
+from ratelimit import TokenBucket
+from search_index import SearchIndexStore
+from storage import S3Storage, create_storage
+
+# is_philosophy_related + the selection call
+OPENAI_CALLS_PER_RECORD = 2
+
+
+class JsonlSink:
+    def __init__(self, path):
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, record_id, result):
+        line = json.dumps(result, default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class StorageSink:
+    """One object per record under an s3://bucket/prefix/ location."""
+
+    def __init__(self, url):
+        bucket, _, prefix = url[len("s3://"):].partition("/")
+        if prefix and not prefix.endswith("/"):
+            prefix += "/"
+        self.storage = S3Storage(bucket, region=os.getenv("AWS_DEFAULT_REGION", "us-east-1"))
+        self.prefix = prefix
+
+    def write(self, record_id, result):
+        self.storage.put_json(f"{self.prefix}{record_id}.json", result)
+
+    def close(self):
+        pass
+
+
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.done = {line.rstrip("\n") for line in f if line.strip()}
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def mark(self, record_id):
+        with self._lock:
+            self._file.write(f"{record_id}\n")
+            self._file.flush()
+            self.done.add(record_id)
+
+    def close(self):
+        self._file.close()
+
+
+def read_records(path):
+    """Yield (record_id, record) without loading the whole file."""
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Skipping line {line_number}: {e}", file=sys.stderr)
+                continue
+            if not isinstance(record, dict):
+                print(f"Skipping line {line_number}: not a JSON object", file=sys.stderr)
+                continue
+            record_id = str(record.get("id") or record.get("discussionId") or f"line-{line_number}")
+            yield record_id, record
+
+
+class DiscussionWriter:
+    """Saves matched records as discussions the way /api/discussions/match/ does."""
+
+    def __init__(self):
+        self.storage = create_storage()
+        self.search_index = SearchIndexStore(self.storage)
+        # Only useful with CACHE_SHARED_PATH, where the web workers read the same cache
+        self.user_cache = create_user_cache()
+
+    def save(self, user_id, conversation_data):
+        key = self.storage.put_discussion(user_id, conversation_data)
+        self.user_cache.invalidate_discussions(user_id)
+        try:
+            self.search_index.update(user_id, conversation_data)
+        except Exception as e:
+            print(f"Search index update failed for {user_id}: {e}", file=sys.stderr)
+        return key
+
+
+def process_record(record_id, record, bucket, retries, writer):
+    """Match one record; returns the result line to write."""
+    if "messages" not in record:
+        text = record.get("text") or record.get("dilemma") or ""
+        record = dict(record, messages=[{"text": text}])
+
+    try:
+        user_input = dilemma_from_request(record)
+    except MatchError as e:
+        return dict(e.to_dict(), id=record_id, status="rejected")
+
+    for attempt in range(retries + 1):
+        bucket.acquire(OPENAI_CALLS_PER_RECORD)
+        try:
+            philosopher_id, result = match_philosopher(user_input)
+            break
+        except MatchError as e:
+            if e.status < 500:
+                return dict(e.to_dict(), id=record_id, status="rejected")
+            if attempt == retries:
+                return dict(e.to_dict(), id=record_id, status="failed")
+            time.sleep(min(2 ** attempt, 30))
+
+    output = {
+        "id": record_id,
+        "status": "matched",
+        "philosopher_id": philosopher_id,
+        "reasoning": result["reasoning"],
+        "response": result["initial_response"],
+    }
+    user_id = record.get("user_id")
+    if writer and user_id:
+        conversation_id = record.get("discussionId") or str(uuid.uuid4())
+        conversation_data = build_match_discussion(conversation_id, user_input, philosopher_id, result)
+        output["key"] = writer.save(user_id, conversation_data)
+    return output
+
+
+def run(args):
+    sink = StorageSink(args.output) if args.output.startswith("s3://") else JsonlSink(args.output)
+    checkpoint = Checkpoint(args.checkpoint or _default_checkpoint(args.output))
+    writer = DiscussionWriter() if args.persist else None
+    # Spread the per-minute budget evenly; allow bursts of one record per worker
+    bucket = TokenBucket(args.rpm / 60.0, capacity=max(OPENAI_CALLS_PER_RECORD, args.concurrency * OPENAI_CALLS_PER_RECORD))
+    # Cap queued records so a huge input file never sits in memory
+    in_flight = threading.BoundedSemaphore(args.concurrency * 2)
+    counts = {"matched": 0, "rejected": 0, "failed": 0, "skipped": 0}
+    counts_lock = threading.Lock()
+    started = time.monotonic()
+
+    def finish(record_id, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {"id": record_id, "status": "failed", "error": str(e)}
+        try:
+            if result["status"] == "failed":
+                # Retried by the next run; writing it now would leave two rows for the id
+                print(f"{record_id} failed: {result.get('error')}", file=sys.stderr)
+            else:
+                sink.write(record_id, result)
+                checkpoint.mark(record_id)
+        finally:
+            in_flight.release()
+        with counts_lock:
+            counts[result["status"]] += 1
+            processed = counts["matched"] + counts["rejected"] + counts["failed"]
+        if processed % args.progress_every == 0:
+            _report(counts, started)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for record_id, record in read_records(args.input):
+            if record_id in checkpoint.done:
+                with counts_lock:
+                    counts["skipped"] += 1
+                continue
+            in_flight.acquire()
+            future = executor.submit(process_record, record_id, record, bucket, args.retries, writer)
+            future.add_done_callback(lambda f, record_id=record_id: finish(record_id, f))
+
+    sink.close()
+    checkpoint.close()
+    _report(counts, started)
+    return counts
+
+
+def _report(counts, started):
+    processed = counts["matched"] + counts["rejected"] + counts["failed"]
+    minutes = max(time.monotonic() - started, 1e-6) / 60
+    print(
+        f"{processed} processed ({counts['matched']} matched, {counts['rejected']} rejected, "
+        f"{counts['failed']} failed, {counts['skipped']} skipped) - {processed / minutes:.1f} records/min",
+        file=sys.stderr,
+    )
+
+
+def _default_checkpoint(output):
+    if output.startswith("s3://"):
+        # One file per destination, so run-2/ never skips ids finished for run-1/
+        name = re.sub(r"[^A-Za-z0-9._-]+", "_", output[len("s3://"):].strip("/"))
+        return f"batch_match-{name}.checkpoint"
+    return output + ".checkpoint"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Match a JSONL file of dilemmas to philosophers.")
+    parser.add_argument("input", help="JSONL file of dilemmas")
+    parser.add_argument("--output", required=True, help="results .jsonl path or s3://bucket/prefix/")
+    parser.add_argument("--checkpoint", help="completed record ids (default: <output>.checkpoint, or "
+                                             "batch_match-<bucket_prefix>.checkpoint for s3:// outputs)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rpm", type=float, default=float(os.getenv("OPENAI_RPM", "500")),
+                        help="OpenAI requests per minute shared by all workers")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--persist", action="store_true",
+                        help="also save matched records with a user_id as discussions")
+    parser.add_argument("--progress-every", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"))
+    counts = run(args)
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
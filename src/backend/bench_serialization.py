@@ -0,0 +1,106 @@
+"""
+Benchmark JSON encoding and compression for the API's largest payloads.
+
+    python bench_serialization.py
+    python bench_serialization.py --discussions 200 --messages 40
+    STORAGE_BACKEND=sqlite python bench_serialization.py --user-id <user_id>
+
+For each endpoint payload it prints encode time with the old
+json.dumps(default=str) path and with serialization.dumps (orjson when
+installed), plus the body size raw, gzipped and brotli-compressed. With
+--user-id the discussions payload is that user's real data from storage
+instead of a synthetic one.
+"""
+import argparse
+import json
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from serialization import available_encodings, compress, dumps, orjson
+
+
+def synthetic_discussion(messages, started):
+    text = ("Is it ever right to break a promise to a friend if keeping it means "
+            "hurting someone else? I keep going back and forth on this. ")
+    return {
+        "id": str(uuid.uuid4()),
+        "philosopherId": "kant",
+        "philosopherName": "Immanuel Kant",
+        "messages": [
+            {
+                "id": str(uuid.uuid4()),
+                "text": text * (1 + i % 4),
+                "sender": "user" if i % 2 == 0 else "philosopher",
+                # Real datetimes, to exercise the encoder rather than pre-formatted strings
+                "timestamp": started + timedelta(minutes=i),
+            }
+            for i in range(messages)
+        ],
+        "createdAt": started,
+        "updatedAt": started + timedelta(minutes=messages),
+        "title": text[:50] + "...",
+        "hasPhilosopherMatch": True,
+    }
+
+
+def payloads(args):
+    now = datetime.now()
+    if args.user_id:
+        from storage import create_storage
+        discussions = [d for _, d in create_storage().iter_discussions(args.user_id)]
+    else:
+        discussions = [synthetic_discussion(args.messages, now - timedelta(days=i))
+                       for i in range(args.discussions)]
+    one = discussions[0] if discussions else synthetic_discussion(args.messages, now)
+    return {
+        "get_discussions": {"results": discussions},
+        "save_discussion": {
+            "conversation_id": one["id"],
+            "philosopher_id": "kant",
+            "reasoning": "Duty-based question about promises.",
+            "response": one["messages"][0]["text"] if one["messages"] else "",
+            "discussion": one,
+            "key": f"private/bench/discussions/{one['id']}.json",
+        },
+        "continue_discussion": {"discussion": one, "philosopher_id": "kant", "key": "bench"},
+    }
+
+
+def timed(fn, value, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(value)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark API JSON encoding and compression.")
+    parser.add_argument("--discussions", type=int, default=100, help="synthetic discussions per user")
+    parser.add_argument("--messages", type=int, default=30, help="messages per synthetic discussion")
+    parser.add_argument("--user-id", help="benchmark this user's stored discussions instead")
+    parser.add_argument("--repeat", type=int, default=20, help="best of this many runs")
+    args = parser.parse_args(argv)
+
+    print(f"encoder: {'orjson' if orjson is not None else 'stdlib json'}")
+    encodings = available_encodings()
+    header = f"{'endpoint':<22}{'stdlib ms':>11}{'fast ms':>10}{'speedup':>9}{'raw KB':>10}"
+    header += "".join(f"{coding + ' KB':>10}{coding + ' ms':>9}" for coding in encodings)
+    print(header)
+    for endpoint, value in payloads(args).items():
+        stdlib = timed(lambda v: json.dumps(v, default=str).encode(), value, args.repeat)
+        fast = timed(dumps, value, args.repeat)
+        body = dumps(value)
+        row = f"{endpoint:<22}{stdlib * 1000:>11.2f}{fast * 1000:>10.2f}{stdlib / fast:>8.1f}x{len(body) / 1024:>10.1f}"
+        for coding in encodings:
+            seconds = timed(lambda b: compress(b, coding), body, max(1, args.repeat // 4))
+            row += f"{len(compress(body, coding)) / 1024:>10.1f}{seconds * 1000:>9.2f}"
+        print(row)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from serialization import dumps
+
+# Returned by get() when nothing is cached for a key. A cached None is a
+# negative result ("we looked and it does not exist") and is a hit.
+MISS = object()
+
+
+class TTLCache:
+    """Bounded in-process LRU cache whose entries expire after a TTL."""
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # Reentrant so set_if() can run get() and set() under one hold
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISS
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return MISS
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def set_if(self, key, value, guard_key, expected, ttl=None):
+        """set() only while guard_key still holds expected; True if it was set."""
+        with self._lock:
+            if self.get(guard_key) != expected:
+                return False
+            self.set(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SQLiteCache:
+    """
+    Cache stored in a local SQLite file so that every worker process on the
+    host sees the same entries. Values must be JSON serializable.
+    """
+
+    def __init__(self, path, max_entries=10000, ttl=300):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or row[1] <= time.time():
+            return MISS
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, dumps(value).decode("utf-8"), expires_at),
+        )
+        self._prune(conn)
+
+    def set_if(self, key, value, guard_key, expected, ttl=None):
+        """set() only while guard_key still holds expected; True if it was set."""
+        conn = self._conn()
+        # IMMEDIATE takes the write lock up front, so no other worker can
+        # change guard_key between the check and the write
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self.get(guard_key) != expected:
+                conn.execute("ROLLBACK")
+                return False
+            self.set(key, value, ttl)
+            conn.execute("COMMIT")
+            return True
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def _prune(self, conn):
+        conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        conn.execute(
+            "DELETE FROM cache WHERE key IN ("
+            " SELECT key FROM cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+
+class UserDataCache:
+    """
+    Read cache for user profiles and discussions.
+
+    Saved profiles are written through; a saved discussion drops the user's
+    cached set so the next read reloads it. Missing profiles are remembered
+    for a shorter negative TTL.
+
+    Every write also replaces a per-user generation token. Readers take
+    generation() before going to storage and hand it to the set_* call, which
+    then only stores the result if no write happened in between, so a slow
+    load can never put older data back over a newer write.
+    """
+
+    def __init__(self, backend, negative_ttl=30):
+        self.backend = backend
+        self.negative_ttl = negative_ttl
+
+    def generation(self, user_id):
+        return self.backend.get(f"generation:{user_id}")
+
+    def _bump(self, user_id):
+        # Before the data write: a reader holding the old token must lose
+        self.backend.set(f"generation:{user_id}", uuid.uuid4().hex)
+
+    def _fill(self, key, value, user_id, generation, ttl=None):
+        self.backend.set_if(key, value, f"generation:{user_id}", generation, ttl)
+
+    def get_profile(self, user_id):
+        return self.backend.get(f"profile:{user_id}")
+
+    def set_profile(self, user_id, profile, generation=None):
+        """Write-through a saved profile, or cache a loaded one given its generation."""
+        if generation is None:
+            self._bump(user_id)
+            self.backend.set(f"profile:{user_id}", _plain(profile))
+        else:
+            self._fill(f"profile:{user_id}", _plain(profile), user_id, generation)
+
+    def set_profile_missing(self, user_id, generation):
+        self._fill(f"profile:{user_id}", None, user_id, generation, ttl=self.negative_ttl)
+
+    def get_discussions(self, user_id):
+        """Every discussion of a user keyed by discussion id, or MISS."""
+        return self.backend.get(f"discussions:{user_id}")
+
+    def set_discussions(self, user_id, discussions, generation):
+        """Cache a full set loaded from storage after generation() returned generation."""
+        self._fill(f"discussions:{user_id}", _plain(discussions), user_id, generation)
+
+    def invalidate_discussions(self, user_id):
+        """A discussion was saved; the next read reloads the whole set."""
+        # Dropping the entry is atomic everywhere, unlike merging into it
+        self._bump(user_id)
+        self.backend.delete(f"discussions:{user_id}")
+
+    def invalidate_user(self, user_id):
+        self._bump(user_id)
+        self.backend.delete(f"profile:{user_id}")
+        self.backend.delete(f"discussions:{user_id}")
+
+
+def _plain(value):
+    # Store exactly what a later read from storage would return: the same
+    # encoder writes both, so datetimes come back as the same ISO strings
+    return json.loads(dumps(value))
+
+
+def create_user_cache():
+    ttl = int(os.getenv("CACHE_TTL_SECONDS", "300"))
+    max_entries = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+    shared_path = os.getenv("CACHE_SHARED_PATH")
+    if shared_path:
+        # One store for all workers keeps them coherent after writes
+        backend = SQLiteCache(shared_path, max_entries=max_entries, ttl=ttl)
+    else:
+        backend = TTLCache(max_entries=max_entries, ttl=ttl)
+    return UserDataCache(backend, negative_ttl=int(os.getenv("CACHE_NEGATIVE_TTL_SECONDS", "30")))
@@ -0,0 +1,134 @@
+import copy
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+from serialization import dumps
+from storage import StorageError
+
+# A published catalog. Snapshots are never mutated after they are built; a
+# refresh or upload swaps in a whole new one, so readers need no locking.
+CatalogSnapshot = namedtuple(
+    "CatalogSnapshot", ["version", "etag", "philosophers", "body", "gzip_body", "built_at"]
+)
+
+
+class PhilosopherCatalog:
+    """
+    Merges the static PHILOSOPHERS table with the profiles stored under
+    philosopher_data/ and serves the result from memory.
+
+    Storage is only touched by refresh(), which runs in a background thread
+    and re-reads just the profiles whose etag changed since the last pass.
+    """
+
+    def __init__(self, storage, static_philosophers, refresh_interval=300, logger=None):
+        self.storage = storage
+        self.refresh_interval = refresh_interval
+        self.logger = logger
+        self._static = copy.deepcopy(static_philosophers)
+        # philosopher id -> (etag, profile) for every stored profile
+        self._remote = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._snapshot = self._build(0)
+
+    def snapshot(self):
+        return self._snapshot
+
+    def refresh(self):
+        """Sync with storage and publish a new snapshot if anything changed."""
+        with self._lock:
+            remote = {}
+            for philosopher_id, etag in self.storage.list_philosophers().items():
+                cached = self._remote.get(philosopher_id)
+                if cached and cached[0] == etag:
+                    remote[philosopher_id] = cached
+                    continue
+                try:
+                    data = self.storage.get_philosopher(philosopher_id)
+                except (StorageError, json.JSONDecodeError) as e:
+                    self._warn(f"Skipping catalog entry {philosopher_id}: {e}")
+                    data = None
+                if data is None:
+                    if cached:
+                        remote[philosopher_id] = cached
+                    continue
+                remote[philosopher_id] = (etag, data)
+            self._remote = remote
+            return self._publish()
+
+    def put(self, philosopher_id, data):
+        """Apply a write that already went to storage without re-listing it."""
+        if not isinstance(philosopher_id, str) or not philosopher_id:
+            raise ValueError(f"Invalid philosopher id: {philosopher_id!r}")
+        with self._lock:
+            # The stored etag is unknown here; the next refresh re-reads it once.
+            self._remote[philosopher_id] = (None, copy.deepcopy(data))
+            return self._publish()
+
+    def start(self):
+        """Refresh once, then keep refreshing in a daemon thread."""
+        if self._thread is not None:
+            return
+        self._refresh_safely()
+        self._thread = threading.Thread(target=self._run, name="philosopher-catalog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            self._refresh_safely()
+
+    def _refresh_safely(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            # Keep serving the last good snapshot.
+            self._warn(f"Catalog refresh failed: {e}")
+
+    def _publish(self):
+        current = self._snapshot
+        candidate = self._build(current.version + 1)
+        if candidate.etag == current.etag:
+            return current
+        self._snapshot = candidate
+        return candidate
+
+    def _build(self, version):
+        merged = {}
+        for philosopher_id, static in self._static.items():
+            merged[philosopher_id] = dict(copy.deepcopy(static), id=philosopher_id)
+        # Sorted, so workers holding the same profiles produce the same bytes
+        for philosopher_id, (_, data) in sorted(self._remote.items()):
+            entry = merged.setdefault(philosopher_id, {"id": philosopher_id})
+            entry.update(copy.deepcopy(data))
+
+        # The ETag covers content only, so an unchanged refresh keeps it stable
+        # across versions and across workers. version is a per-process counter
+        # and so stays out of the body (it is sent as X-Catalog-Version).
+        content = json.dumps(merged, sort_keys=True, separators=(",", ":"), default=str).encode()
+        etag = hashlib.sha256(content).hexdigest()[:32]
+        body = dumps({"results": merged})
+        return CatalogSnapshot(
+            version=version,
+            etag=etag,
+            philosophers=MappingProxyType(merged),
+            body=body,
+            # Compressed once per version instead of once per response
+            gzip_body=gzip.compress(body, compresslevel=9, mtime=0),
+            built_at=time.time(),
+        )
+
+    def _warn(self, message):
+        if self.logger:
+            self.logger.warning(message)
+        else:
+            print(message)
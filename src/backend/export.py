@@ -0,0 +1,21 @@
+import zlib
+
+from serialization import dumps
+
+
+def ndjson_discussions(storage, user_id, prefetch=8, logger=None):
+    """One discussion per line, each tagged with its id."""
+    for discussion_id, data in storage.iter_discussions(user_id, prefetch, logger):
+        if isinstance(data, dict):
+            data.setdefault("id", discussion_id)
+        yield dumps(data) + b"\n"
+
+
+def gzip_chunks(chunks, level=6):
+    """Gzip a stream of byte chunks on the fly."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -0,0 +1,182 @@
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from datetime import datetime
+
+
+class RollingWindow:
+    """
+    The last `size` probe outcomes of one dependency.
+
+    trip_after failures in a row mark it down at once, without waiting for
+    the error rate over the window to cross its limit; recover_after
+    successes in a row bring it back and drop the outage from the window.
+    """
+
+    def __init__(self, size, trip_after=3, recover_after=2):
+        self.samples = deque(maxlen=size)
+        self.trip_after = trip_after
+        self.recover_after = recover_after
+        self.last_error = None
+        self.failures_in_a_row = 0
+        self.successes_in_a_row = 0
+        self.tripped = False
+
+    def record(self, ok, latency, error=None):
+        self.samples.append((ok, latency))
+        if ok:
+            self.failures_in_a_row = 0
+            self.successes_in_a_row += 1
+            if self.tripped and self.successes_in_a_row >= self.recover_after:
+                self.tripped = False
+                recent = list(self.samples)[-self.successes_in_a_row:]
+                self.samples.clear()
+                self.samples.extend(recent)
+        else:
+            self.last_error = error
+            self.successes_in_a_row = 0
+            self.failures_in_a_row += 1
+            if self.failures_in_a_row >= self.trip_after:
+                self.tripped = True
+
+    def stats(self):
+        if not self.samples:
+            return {"samples": 0, "error_rate": 0.0, "p50_ms": None, "p95_ms": None}
+        # Latency of successful probes only; failures are covered by error_rate
+        latencies = sorted(latency for ok, latency in self.samples if ok)
+        failures = len(self.samples) - len(latencies)
+        return {
+            "samples": len(self.samples),
+            "error_rate": round(failures / len(self.samples), 3),
+            "p50_ms": round(_percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+            "p95_ms": round(_percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+        }
+
+
+def _percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class DependencyMonitor:
+    """
+    Probes dependencies in a background thread and keeps the health responses
+    precomputed, so the health endpoints never touch a dependency themselves.
+
+    probes maps a dependency name to (check, max_p95_seconds); check raises on
+    failure. The service is ready while every dependency stays under both its
+    p95 latency limit and max_error_rate over the rolling window, and has not
+    failed trip_after probes in a row.
+    """
+
+    def __init__(self, probes, interval=10, window=30, max_error_rate=0.5, probe_timeout=5,
+                 trip_after=3, recover_after=2, metrics=None, logger=None):
+        self.probes = probes
+        self.interval = interval
+        self.max_error_rate = max_error_rate
+        self.probe_timeout = probe_timeout
+        self.metrics = metrics
+        self.logger = logger
+        self.windows = {name: RollingWindow(window, trip_after, recover_after) for name in probes}
+        # name -> future of its latest probe, which may outlive probe_timeout
+        self._running = {}
+        self._executor = ThreadPoolExecutor(max_workers=max(2, len(probes) * 2), thread_name_prefix="health-probe")
+        self._stop = threading.Event()
+        self._thread = None
+        self.live_body = json.dumps({"status": "alive"}).encode()
+        self._publish(checked_at=None)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="dependency-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                self._warn(f"Health probe loop failed: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+    def run_once(self):
+        futures = {}
+        for name, (check, _) in self.probes.items():
+            previous = self._running.get(name)
+            if previous is not None and not previous.done():
+                # A hung probe still holds its thread; stacking more behind it
+                # would starve the other dependencies' probes of workers
+                self.windows[name].record(False, self.probe_timeout, "previous probe still running")
+                continue
+            future = self._executor.submit(check)
+            self._running[name] = future
+            futures[name] = (time.perf_counter(), future)
+        for name, (started, future) in futures.items():
+            try:
+                future.result(timeout=max(0.0, self.probe_timeout - (time.perf_counter() - started)))
+                self.windows[name].record(True, time.perf_counter() - started)
+            except FutureTimeout:
+                self.windows[name].record(False, self.probe_timeout, f"timed out after {self.probe_timeout}s")
+            except Exception as e:
+                self.windows[name].record(False, time.perf_counter() - started, str(e))
+        self._publish(checked_at=datetime.now().isoformat())
+
+    def _publish(self, checked_at):
+        dependencies = {}
+        ready = checked_at is not None
+        for name, (_, max_p95) in self.probes.items():
+            window = self.windows[name]
+            stats = window.stats()
+            reasons = []
+            if not stats["samples"]:
+                reasons.append("not probed yet")
+            elif window.tripped:
+                if window.successes_in_a_row:
+                    reasons.append(f"recovering ({window.successes_in_a_row}/{window.recover_after} probes ok)")
+                else:
+                    reasons.append(f"{window.failures_in_a_row} probes failed in a row")
+            else:
+                if stats["error_rate"] > self.max_error_rate:
+                    reasons.append(f"error rate {stats['error_rate']:.0%}")
+                if stats["p95_ms"] is not None and stats["p95_ms"] > max_p95 * 1000:
+                    reasons.append(f"p95 {stats['p95_ms']}ms over {max_p95 * 1000:.0f}ms")
+            healthy = not reasons
+            ready = ready and healthy
+            dependencies[name] = dict(
+                stats,
+                status="OK" if healthy else "degraded: " + ", ".join(reasons),
+                last_error=window.last_error,
+            )
+            if self.metrics and stats["samples"]:
+                self.metrics.gauge(f"health.{name}.error_rate", stats["error_rate"])
+                if stats["p95_ms"] is not None:
+                    self.metrics.gauge(f"health.{name}.p95_ms", stats["p95_ms"])
+
+        summary = {
+            "status": "healthy" if ready else "unhealthy",
+            "ready": ready,
+            "checked_at": checked_at,
+            "dependencies": dependencies,
+        }
+        # Compatible with the original /api/health fields
+        summary.update({name: info["status"] for name, info in dependencies.items()})
+        summary["timestamp"] = checked_at
+
+        # One assignment, so readers never pair a stale flag with a new body
+        self.readiness = (ready, json.dumps(summary).encode())
+        if self.metrics:
+            self.metrics.gauge("health.ready", int(ready))
+
+    def _warn(self, message):
+        if self.logger:
+            self.logger.warning(message)
+        else:
+            print(message)
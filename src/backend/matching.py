@@ -0,0 +1,412 @@
+"""
+The dilemma-to-philosopher matching pipeline behind /api/discussions/match/,
+shared with batch_match.py.
+
+Importing this module has no side effects: no threads, no storage and no
+network. The OpenAI client is created on first use.
+"""
+import json
+import os
+import threading
+from datetime import datetime
+
+from openai import OpenAI
+
+PHILOSOPHERS = {
+    "socrates": {
+        "name": "Socrates",
+        "era": "Ancient Greek",
+        "specialties": ["ethics", "epistemology", "virtue", "wisdom"],
+        "style": "Socratic method, questioning, dialectical approach",
+        "key_concepts": ["know thyself", "examined life", "virtue as knowledge"]
+    },
+    "kant": {
+        "name": "Immanuel Kant",
+        "era": "Enlightenment",
+        "specialties": ["ethics", "duty", "categorical imperative", "reason"],
+        "style": "systematic, rigorous, principle-based",
+        "key_concepts": ["categorical imperative", "duty", "autonomy"]
+    },
+    "nietzsche": {
+        "name": "Friedrich Nietzsche",
+        "era": "19th Century",
+        "specialties": ["nihilism", "will to power", "master-slave morality", "authenticity"],
+        "style": "provocative, aphoristic, challenging conventional morality",
+        "key_concepts": ["will to power", "eternal recurrence", "übermensch"]
+    },
+    "aristotle": {
+        "name": "Aristotle",
+        "era": "Ancient Greek",
+        "specialties": ["virtue ethics", "eudaimonia", "practical wisdom", "golden mean"],
+        "style": "analytical, systematic, focused on human flourishing",
+        "key_concepts": ["virtue ethics", "golden mean", "eudaimonia"]
+    },
+    "mill": {
+        "name": "John Stuart Mill",
+        "era": "19th Century",
+        "specialties": ["utilitarianism", "liberty", "happiness", "consequences"],
+        "style": "consequentialist, focused on greatest good for greatest number",
+        "key_concepts": ["utility", "harm principle", "liberty"]
+    },
+    "confucius": {
+        "name": "Confucius",
+        "era": "Ancient Chinese",
+        "specialties": ["virtue", "social harmony", "filial piety", "ritual"],
+        "style": "practical wisdom, emphasis on relationships and social order",
+        "key_concepts": ["ren", "li", "junzi", "filial piety"]
+    },
+    "hume": {
+    "name": "David Hume",
+    "era": "Scottish Enlightenment",
+    "specialties": [
+      "empiricism",
+      "skepticism",
+      "emotions and reason",
+      "causation",
+      "moral sentiments",
+      "is-ought problem"
+    ],
+    "style": "empirical, skeptical of abstract reasoning, emphasizes observation and feeling over pure reason",
+    "key_concepts": [
+      "impressions vs ideas",
+      "bundle theory of self",
+      "moral sentiments",
+      "is-ought gap",
+      "problem of induction",
+      "passion as master of reason"
+    ]
+  },
+  
+  "plato": {
+    "name": "Plato",
+    "era": "Ancient Greek",
+    "specialties": [
+      "theory of forms",
+      "ideal justice",
+      "knowledge vs opinion",
+      "soul and virtue",
+      "philosopher kings",
+      "metaphysics"
+    ],
+    "style": "dialectical through Socratic dialogue, idealistic, uses allegories and myths to convey truth",
+    "key_concepts": [
+      "theory of forms",
+      "allegory of the cave",
+      "tripartite soul",
+      "philosopher king",
+      "anamnesis (recollection)",
+      "the Good"
+    ]
+  },
+  
+  "hegel": {
+    "name": "Georg Wilhelm Friedrich Hegel",
+    "era": "German Idealism",
+    "specialties": [
+      "dialectics",
+      "historical progress",
+      "absolute idealism",
+      "freedom and recognition",
+      "master-slave dialectic",
+      "synthesis of opposites"
+    ],
+    "style": "systematic, dialectical, sees history as rational progress, complex and totalizing",
+    "key_concepts": [
+      "thesis-antithesis-synthesis",
+      "Geist (Spirit)",
+      "master-slave dialectic",
+      "recognition (Anerkennung)",
+      "absolute knowledge",
+      "cunning of reason"
+    ]
+  },
+  
+}
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def openai_client():
+    """The process-wide OpenAI client, created from OPENAI_API_KEY on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        return _client
+
+
+class MatchError(Exception):
+    """A dilemma that could not be matched; status is the HTTP status to answer with."""
+
+    def __init__(self, message, status=500, reason=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.reason = reason
+
+    def to_dict(self):
+        body = {"error": self.message}
+        if self.reason is not None:
+            body["reason"] = self.reason
+        return body
+
+
+def dilemma_from_request(data):
+    """The dilemma text of a /api/discussions/match/ payload."""
+    # Extract user input from the messages array
+    messages = data.get("messages", [])
+    if not messages or not isinstance(messages, list) or len(messages) == 0:
+        raise MatchError("No messages provided", 400)
+    
+    # Get the first message text
+    first_message = messages[0]
+    if not isinstance(first_message, dict) or "text" not in first_message:
+        raise MatchError("Invalid message format", 400)
+    
+    user_input = first_message.get("text", "")
+    if not user_input:
+        raise MatchError("Empty message content", 400)
+    return user_input
+
+
+def match_philosopher(user_input):
+    """
+    Check that a dilemma is philosophical and pick the philosopher for it.
+
+    Returns:
+        tuple[str, dict]: (philosopher_id, parsed selection with reasoning and initial_response)
+    """
+    is_philosophical, reason = is_philosophy_related(user_input)
+    if not is_philosophical:
+        raise MatchError('Input not related to philosophy', 400, reason=reason)
+    
+    # Create philosopher selection prompt
+    philosopher_list = "\n".join([
+        f"- {p['name']}: {', '.join(p['specialties'])}"
+        for p in PHILOSOPHERS.values()
+    ])
+    
+    selection_prompt = f"""
+You are a philosophical advisor. A user has presented: "{user_input}"
+
+Available philosophers:
+{philosopher_list}
+
+Select the MOST appropriate philosopher. Respond with ONLY valid JSON in this exact format:
+{{"philosopher_id": "choose_one_id", "reasoning": "brief explanation", "initial_response": "3-4 sentences in philosopher's voice. Use simple language and avoid complex words."}}
+
+The philosopher_id MUST be one of: {', '.join(PHILOSOPHERS.keys())}
+
+Respond with ONLY the JSON object, no other text.
+"""
+    
+    try:
+        response = openai_client().chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": "You are a philosophical advisor. Respond with ONLY valid JSON in the exact format requested."},
+                {"role": "user", "content": selection_prompt}
+            ],
+            temperature=0.3,
+            max_tokens=200
+        )
+    except Exception as openai_error:
+        print(f"OpenAI API error: {openai_error}")
+        print(f"Error type: {type(openai_error)}")
+        import traceback
+        traceback.print_exc()
+        
+        if "authentication" in str(openai_error).lower() or "401" in str(openai_error):
+            raise MatchError("OpenAI API authentication failed. Please check your API key.")
+        elif "quota" in str(openai_error).lower() or "429" in str(openai_error):
+            raise MatchError("OpenAI API quota exceeded. Please try again later.")
+        elif "rate_limit" in str(openai_error).lower():
+            raise MatchError("OpenAI API rate limit exceeded. Please try again later.")
+        else:
+            raise MatchError(f"OpenAI API error: {str(openai_error)}")
+
+    # Validate response structure
+    if not response.choices or len(response.choices) == 0:
+        raise MatchError("OpenAI returned no choices")
+    
+    if not response.choices[0].message or not response.choices[0].message.content:
+        raise MatchError("OpenAI returned empty message content")
+    
+    content = response.choices[0].message.content.strip()
+    print(f"Raw OpenAI response content: {content}")
+    
+    # Remove any markdown code blocks if present
+    if content.startswith("```"):
+        content = content.split("```")[1]
+        if content.startswith("json"):
+            content = content[4:]
+        content = content.split("```")[0]
+    content = content.strip()
+    
+    print(f"Processed content: {content}")
+    
+    # Validate that content is not empty
+    if not content:
+        raise MatchError("OpenAI returned empty response")
+    
+    try:
+        result = json.loads(content)
+    except json.JSONDecodeError as json_error:
+        print(f"JSON decode error: {json_error}")
+        print(f"Content that failed to parse: {repr(content)}")
+        raise MatchError(f"Failed to parse OpenAI response as JSON: {str(json_error)}")
+    
+    # Validate the JSON structure
+    required_fields = ['philosopher_id', 'reasoning', 'initial_response']
+    missing_fields = [field for field in required_fields if field not in result]
+    if missing_fields:
+        raise MatchError(f"OpenAI response missing required fields: {missing_fields}")
+    
+    philosopher_id = result['philosopher_id']
+    
+    # Validate philosopher_id is valid
+    if philosopher_id not in PHILOSOPHERS:
+        raise MatchError(f"Invalid philosopher_id: {philosopher_id}")
+    
+    print(f"Selected philosopher: {philosopher_id}")
+    print(f"Philosopher details: {PHILOSOPHERS[philosopher_id]}")
+    return philosopher_id, result
+
+
+def build_match_discussion(conversation_id, user_input, philosopher_id, result):
+    """The new discussion stored for a matched dilemma."""
+    return {
+        'id': conversation_id,
+        'philosopherId': philosopher_id,
+        'philosopherName': PHILOSOPHERS[philosopher_id]['name'],
+        'messages': [
+            {
+                'id': 1,
+                'text': user_input,
+                'sender': 'user',
+                'timestamp': datetime.now()
+            },
+            {
+                'id': 2,
+                'text': f"You've been matched with {PHILOSOPHERS[philosopher_id]['name']}!",
+                'sender': 'system',
+                'timestamp': datetime.now(),
+                'type': 'philosopher_match'
+            },
+            {
+                'id': 3,
+                'text': result['initial_response'],
+                'sender': 'philosopher',
+                'timestamp': datetime.now()
+            }
+        ],
+        'createdAt': datetime.now().isoformat(),
+        'updatedAt': datetime.now().isoformat(),
+        'title': user_input[:50] + "..." if len(user_input) > 50 else user_input
+    }
+
+def is_philosophy_related(text_or_messages, is_ongoing_discussion=False) -> tuple[bool, str]:
+    """
+    Determine if text or conversation is related to philosophy, ethics, morality, or seeking philosophical guidance.
+    
+    Args:
+        text_or_messages: Either a string (for new discussions) or a list of messages (for ongoing discussions)
+        is_ongoing_discussion: Boolean indicating if this is an ongoing discussion with context
+    
+    Returns:
+        tuple[bool, str]: (is_philosophical, reason)
+    """
+    
+    if is_ongoing_discussion and isinstance(text_or_messages, list):
+        # For ongoing discussions, examine the context of the last 5 messages
+        if not text_or_messages:
+            print("Warning: Empty messages list provided for ongoing discussion")
+            return True, "Empty conversation, allowing by default"
+            
+        messages = text_or_messages[-5:] if len(text_or_messages) > 5 else text_or_messages
+        
+        # Build conversation context
+        conversation_context = ""
+        for i, msg in enumerate(messages):
+            sender = msg.get("sender", "unknown")
+            text = msg.get("text", "")
+            conversation_context += f"Message {i+1} ({sender}): {text}\n"
+        
+        prompt = f"""
+        Determine if this ongoing conversation is related to philosophy, ethics, morality, or seeking philosophical guidance.
+        
+        Conversation context (last 5 messages):
+        {conversation_context}
+        
+        Consider the overall flow and context of the conversation, not just individual messages.
+        Be lenient with personal dilemmas, ethical questions, life decisions, meaning, purpose, or moral conflicts.
+        Reject only if clearly unrelated (e.g., technical support, recipes, weather, etc.)
+        
+        You MUST respond with ONLY a valid JSON object in this exact format:
+        {{"is_philosophical": true, "reason": "brief explanation here"}}
+        
+        Respond with ONLY the JSON object, no other text.
+        """
+    else:
+        # For new discussions, just evaluate the single message
+        text = text_or_messages if isinstance(text_or_messages, str) else str(text_or_messages)
+        
+        if not text or text.strip() == "":
+            print("Warning: Empty text provided for new discussion")
+            return True, "Empty text, allowing by default"
+        
+        prompt = f"""
+        Determine if the following text is related to philosophy, ethics, morality, or seeking philosophical guidance.
+        
+        Text: "{text}"
+        
+        You MUST respond with ONLY a valid JSON object in this exact format:
+        {{"is_philosophical": true, "reason": "brief explanation here"}}
+        
+        Be lenient with personal dilemmas, ethical questions, life decisions, meaning, purpose, or moral conflicts.
+        Reject only if clearly unrelated (e.g., technical support, recipes, weather, etc.)
+        
+        Respond with ONLY the JSON object, no other text.
+        """
+    
+    try:
+        print(f"Calling is_philosophy_related with is_ongoing_discussion={is_ongoing_discussion}")
+        if is_ongoing_discussion:
+            print(f"Examining conversation context with {len(text_or_messages)} messages")
+        else:
+            print(f"Examining single text: {text_or_messages[:100]}...")
+            
+        response = openai_client().chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": "You are a philosophical content validator. Respond with ONLY valid JSON in the exact format requested."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.3,
+            max_tokens=200
+        )
+        
+        # Clean the response and parse JSON
+        content = response.choices[0].message.content.strip()
+        # Remove any markdown code blocks if present
+        if content.startswith("```"):
+            content = content.split("```")[1]
+            if content.startswith("json"):
+                content = content[4:]
+            content = content.split("```")[0]
+        content = content.strip()
+        print(f"Philosophy validation response: {content}")
+        result = json.loads(content)
+        is_philosophical = result["is_philosophical"]
+        reason = result.get("reason", "")
+        print(f"Philosophy validation result: {is_philosophical}, reason: {reason}")
+        return is_philosophical, reason
+    except Exception as e:
+        # If validation fails, be conservative and allow it
+        print(f"Philosophy validation error: {e}")
+        print(f"Error type: {type(e)}")
+        import traceback
+        traceback.print_exc()
+        return True, "Validation check failed, allowing by default"
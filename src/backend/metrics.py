@@ -0,0 +1,52 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Metrics:
+    """Process-wide counters, gauges and timings, exposed by /api/metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._timings = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            count, total, peak = self._timings.get(name, (0, 0.0, 0.0))
+            self._timings[name] = (count + 1, total + seconds, max(peak, seconds))
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "timings": {
+                    name: {
+                        "count": count,
+                        "avg_ms": round(total / count * 1000, 3) if count else 0,
+                        "max_ms": round(peak * 1000, 3),
+                    }
+                    for name, (count, total, peak) in self._timings.items()
+                },
+            }
+
+
+metrics = Metrics()
@@ -0,0 +1,83 @@
+"""
+Copy stored objects from one storage backend to another.
+
+    python migrate_storage.py --from s3 --to sqlite --sqlite-path philo.db
+    python migrate_storage.py --from sqlite --to s3 --prefix private/
+
+Keys are copied verbatim, so the destination can be switched on with
+STORAGE_BACKEND without touching any data layout. Objects whose etag
+already matches in the destination are skipped, which makes reruns cheap.
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import S3Storage, SQLiteStorage
+
+
+def open_storage(kind, args):
+    if kind == "s3":
+        return S3Storage(args.bucket, region=os.getenv("AWS_DEFAULT_REGION", "us-east-1"))
+    if kind == "sqlite":
+        return SQLiteStorage(args.sqlite_path)
+    raise ValueError(f"Unknown backend: {kind}")
+
+
+def copy_object(source, destination, key, dry_run):
+    obj = source.get(key)
+    if obj is None:
+        return "missing"
+    if not dry_run:
+        encoding = "gzip" if key.endswith(".gz") else None
+        destination.put(key, obj.body, content_encoding=encoding)
+    return "copied"
+
+
+def migrate(source, destination, prefix="", workers=8, dry_run=False):
+    counts = {"copied": 0, "skipped": 0, "missing": 0, "failed": 0}
+    # Both backends use the quoted MD5 of the body as the etag of a plain put
+    existing = dict(destination.list(prefix))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for key, etag in source.list(prefix):
+            if etag and existing.get(key) == etag:
+                counts["skipped"] += 1
+                continue
+            futures[executor.submit(copy_object, source, destination, key, dry_run)] = key
+        for future, key in futures.items():
+            try:
+                counts[future.result()] += 1
+            except Exception as e:
+                counts["failed"] += 1
+                print(f"Failed to copy {key}: {e}", file=sys.stderr)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Copy data between storage backends.")
+    parser.add_argument("--from", dest="source", choices=["s3", "sqlite"], required=True)
+    parser.add_argument("--to", dest="destination", choices=["s3", "sqlite"], required=True)
+    parser.add_argument("--prefix", default="", help="only copy keys under this prefix")
+    parser.add_argument("--bucket", default=os.getenv("S3_BUCKET", "philo-ai"))
+    parser.add_argument("--sqlite-path", default=os.getenv("SQLITE_PATH", "philo.db"))
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.source == args.destination:
+        parser.error("--from and --to must differ")
+
+    counts = migrate(
+        open_storage(args.source, args),
+        open_storage(args.destination, args),
+        prefix=args.prefix,
+        workers=args.workers,
+        dry_run=args.dry_run,
+    )
+    print(", ".join(f"{name}: {count}" for name, count in counts.items()))
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+import gzip
+import heapq
+import json
+import math
+import re
+import threading
+from collections import Counter
+
+from cache import MISS, TTLCache
+from storage import NOT_MODIFIED, PreconditionFailed
+
+TOKEN_RE = re.compile(r"[^\W_]+(?:'[^\W_]+)?")
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have i if in into is it its me my
+no not of on or so that the their then there these they this to was we were
+what when which who why will with you your
+""".split())
+
+# BM25 parameters (the usual defaults)
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text):
+    """Lowercased word tokens with stopwords and single characters removed."""
+    return [
+        token for token in TOKEN_RE.findall(text.lower())
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+
+def discussion_text(discussion):
+    parts = [discussion.get("title") or ""]
+    for message in discussion.get("messages") or []:
+        if isinstance(message, dict):
+            parts.append(str(message.get("text") or ""))
+    return "\n".join(parts)
+
+
+class DiscussionIndex:
+    """
+    Inverted index over one user's discussions.
+
+    postings maps term -> {doc_id: term frequency}; docs keeps the length and
+    the summary fields returned with hits, so a search never has to open the
+    discussions themselves.
+    """
+
+    def __init__(self):
+        self.docs = {}
+        self.postings = {}
+        self.total_length = 0
+        # doc_id -> terms it contributed, so a re-index can drop stale postings
+        self._doc_terms = {}
+
+    def add(self, discussion):
+        doc_id = discussion["id"]
+        self.remove(doc_id)
+        counts = Counter(tokenize(discussion_text(discussion)))
+        length = sum(counts.values())
+        self.docs[doc_id] = {
+            "length": length,
+            "title": discussion.get("title", ""),
+            "updatedAt": discussion.get("updatedAt", ""),
+            "philosopherName": discussion.get("philosopherName", ""),
+        }
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        self._doc_terms[doc_id] = list(counts)
+        self.total_length += length
+
+    def remove(self, doc_id):
+        doc = self.docs.pop(doc_id, None)
+        if doc is None:
+            return
+        self.total_length -= doc["length"]
+        for term in self._doc_terms.pop(doc_id, ()):
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(doc_id, None)
+            if not postings:
+                del self.postings[term]
+
+    def search(self, query, limit=20):
+        """BM25-ranked hits; only the postings of the query terms are read."""
+        terms = set(tokenize(query))
+        n = len(self.docs)
+        if not terms or not n:
+            return []
+        avg_length = self.total_length / n or 1
+        scores = Counter()
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for doc_id, tf in postings.items():
+                norm = K1 * (1 - B + B * self.docs[doc_id]["length"] / avg_length)
+                scores[doc_id] += idf * tf * (K1 + 1) / (tf + norm)
+        top = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [
+            {
+                "id": doc_id,
+                "title": self.docs[doc_id]["title"],
+                "updatedAt": self.docs[doc_id]["updatedAt"],
+                "philosopherName": self.docs[doc_id]["philosopherName"],
+                "score": round(score, 4),
+            }
+            for doc_id, score in top
+        ]
+
+    def to_bytes(self):
+        # Postings reference documents by position to keep the object small
+        doc_ids = list(self.docs)
+        position = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+        payload = {
+            "v": 1,
+            "docs": [
+                [doc_id, d["length"], d["title"], d["updatedAt"], d["philosopherName"]]
+                for doc_id, d in self.docs.items()
+            ],
+            "postings": {
+                term: [x for doc_id, tf in postings.items() for x in (position[doc_id], tf)]
+                for term, postings in self.postings.items()
+            },
+        }
+        return gzip.compress(json.dumps(payload, separators=(",", ":"), default=str).encode())
+
+    @classmethod
+    def from_bytes(cls, data):
+        payload = json.loads(gzip.decompress(data))
+        index = cls()
+        doc_ids = []
+        for doc_id, length, title, updated_at, philosopher_name in payload["docs"]:
+            doc_ids.append(doc_id)
+            index.docs[doc_id] = {
+                "length": length,
+                "title": title,
+                "updatedAt": updated_at,
+                "philosopherName": philosopher_name,
+            }
+            index._doc_terms[doc_id] = []
+            index.total_length += length
+        for term, flat in payload["postings"].items():
+            postings = {}
+            for i in range(0, len(flat), 2):
+                doc_id = doc_ids[flat[i]]
+                postings[doc_id] = flat[i + 1]
+                index._doc_terms[doc_id].append(term)
+            index.postings[term] = postings
+        return index
+
+
+class SearchIndexStore:
+    """
+    Loads, caches and persists the per-user indexes stored at
+    private/{user_id}/search/index.json.gz.
+
+    A user without an index object gets one built from their existing
+    discussions the first time it is needed; nothing is stored for a user
+    who has no discussions, so searching unknown ids writes nothing. Writes are conditional on the
+    etag that was loaded, so workers indexing for the same user retry on
+    top of each other's changes instead of overwriting them.
+    """
+
+    def __init__(self, storage, max_cached=256, ttl=300, max_attempts=5, lock_stripes=64, logger=None):
+        self.storage = storage
+        self.max_attempts = max_attempts
+        self.logger = logger
+        # user_id -> (etag, DiscussionIndex)
+        self._cache = TTLCache(max_entries=max_cached, ttl=ttl)
+        # A fixed set of locks shared by hash, so memory does not grow with user ids
+        self._locks = [threading.Lock() for _ in range(lock_stripes)]
+
+    def search(self, user_id, query, limit=20):
+        with self._lock(user_id):
+            _, index = self._load(user_id)
+            return index.search(query, limit)
+
+    def update(self, user_id, discussion):
+        """Re-index one discussion after it was saved and persist the index."""
+        with self._lock(user_id):
+            for attempt in range(1, self.max_attempts + 1):
+                etag, index = self._load(user_id)
+                index.add(discussion)
+                try:
+                    self._save(user_id, index, etag)
+                    return
+                except PreconditionFailed:
+                    # Another worker saved first; reload its index and add ours on top
+                    self._cache.delete(user_id)
+                    if attempt == self.max_attempts:
+                        raise
+                except Exception:
+                    # The cached index was changed in place but never saved
+                    self._cache.delete(user_id)
+                    raise
+
+    def _load(self, user_id):
+        # Always revalidated: another worker may have written since we cached it,
+        # and an unchanged index costs only a 304
+        cached = self._cache.get(user_id)
+        etag = None if cached is MISS else cached[0]
+        obj = self.storage.get(self.storage.search_index_key(user_id), if_none_match=etag)
+        if obj is NOT_MODIFIED:
+            self._cache.set(user_id, cached)
+            return cached
+        if obj is None:
+            index = self._build(user_id)
+            if not index.docs:
+                # Nothing to index (possibly not a real user): don't store or cache anything
+                return None, index
+            try:
+                return self._save(user_id, index, None)
+            except PreconditionFailed:
+                # Another worker built it at the same time; use theirs
+                obj = self.storage.get(self.storage.search_index_key(user_id))
+                if obj is None:
+                    raise
+
+        entry = (obj.etag, DiscussionIndex.from_bytes(obj.body))
+        self._cache.set(user_id, entry)
+        return entry
+
+    def _save(self, user_id, index, etag):
+        """Persist index if the stored one still has etag (None: if none is stored)."""
+        etag = self.storage.put(
+            self.storage.search_index_key(user_id),
+            index.to_bytes(),
+            content_encoding="gzip",
+            if_match=etag,
+            if_none_match=None if etag else "*",
+        )
+        entry = (etag, index)
+        self._cache.set(user_id, entry)
+        return entry
+
+    def _build(self, user_id):
+        index = DiscussionIndex()
+        for discussion_id, discussion in self.storage.iter_discussions(user_id, logger=self.logger):
+            if isinstance(discussion, dict):
+                discussion.setdefault("id", discussion_id)
+                index.add(discussion)
+        return index
+
+    def _lock(self, user_id):
+        return self._locks[hash(user_id) % len(self._locks)]
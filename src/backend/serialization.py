@@ -0,0 +1,168 @@
+"""
+JSON encoding and response compression for the API.
+
+Encoding goes through orjson (pinned in requirements.txt; it serializes
+datetimes natively and is several times faster than the stdlib). Should it be
+missing, the stdlib encoder is used with the same output conventions, so
+either way datetimes come out as ISO 8601.
+"""
+import gzip
+import json
+import time
+from datetime import date, datetime
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pinned in requirements.txt; the stdlib fallback is only slower
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pinned in requirements.txt; gzip alone still works
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "application/x-ndjson", "text/html", "text/plain", "text/css"}
+
+
+class RawJSON:
+    """Bytes that are already valid JSON, spliced into a dumps() result as-is."""
+
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    # Same catch-all the endpoints used to get from json.dumps(default=str)
+    return str(value)
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def _encode(value):
+        return orjson.dumps(value, default=_default, option=_ORJSON_OPTIONS)
+else:
+    def _encode(value):
+        return json.dumps(value, default=_default, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def dumps(value):
+    """Serialize to UTF-8 JSON bytes.
+
+    Top-level values of a dict may be RawJSON, e.g. a discussion body that was
+    just written to storage, so the same bytes are not encoded twice.
+    """
+    if isinstance(value, dict) and any(isinstance(v, RawJSON) for v in value.values()):
+        parts = []
+        for key, item in value.items():
+            encoded = item.data if isinstance(item, RawJSON) else _encode(item)
+            parts.append(_encode(str(key)) + b":" + encoded)
+        return b"{" + b",".join(parts) + b"}"
+    return _encode(value)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by dumps(), so jsonify() and every endpoint
+    get the fast encoder. Encode time and body size are recorded per endpoint.
+    """
+
+    def __init__(self, app, metrics=None):
+        super().__init__(app)
+        self.metrics = metrics
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if orjson is not None:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        started = time.perf_counter()
+        body = dumps(obj)
+        if self.metrics:
+            endpoint = request.endpoint or "unknown"
+            self.metrics.observe(f"json.encode.{endpoint}", time.perf_counter() - started)
+            self.metrics.incr(f"json.bytes.{endpoint}", len(body))
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def parse_accept_encoding(header):
+    """{coding: q} from an Accept-Encoding header."""
+    accepted = {}
+    for part in (header or "").split(","):
+        pieces = part.strip().split(";")
+        coding = pieces[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in pieces[1:]:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def negotiate_encoding(header, available):
+    """First coding in `available` the client accepts, or None for identity."""
+    accepted = parse_accept_encoding(header)
+    for coding in available:
+        if accepted.get(coding, accepted.get("*", 0)) > 0:
+            return coding
+    return None
+
+
+def available_encodings():
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def compress(data, coding):
+    # Dynamic responses: favour speed over the last few percent of ratio
+    if coding == "br":
+        return brotli.compress(data, quality=4)
+    return gzip.compress(data, compresslevel=6)
+
+
+def compress_response(response, min_size=1024, metrics=None):
+    """after_request hook: compress large JSON/text bodies the client accepts."""
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers
+            # Compressing would need a per-encoding validator; those endpoints handle it
+            or "ETag" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+
+    response.vary.add("Accept-Encoding")
+    coding = negotiate_encoding(request.headers.get("Accept-Encoding"), available_encodings())
+    if coding is None:
+        return response
+    started = time.perf_counter()
+    compressed = compress(data, coding)
+    if len(compressed) >= len(data):
+        return response
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = coding
+    if metrics:
+        endpoint = request.endpoint or "unknown"
+        metrics.observe(f"compress.{endpoint}", time.perf_counter() - started)
+        metrics.incr(f"compress.bytes_in.{endpoint}", len(data))
+        metrics.incr(f"compress.bytes_out.{endpoint}", len(compressed))
+    return response
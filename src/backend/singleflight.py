@@ -0,0 +1,60 @@
+import threading
+
+
+class SingleFlightTimeout(Exception):
+    pass
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls that share a key into one execution.
+
+    The first caller runs fn; callers arriving while it is in flight wait for
+    and receive the same result, or the same exception. Once the call finishes
+    the key is forgotten, so this never serves stale data the way a cache can.
+    """
+
+    def __init__(self, name, metrics=None):
+        self.name = name
+        self.metrics = metrics
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            self._incr("shared")
+            if not call.done.wait(timeout):
+                self._incr("timeouts")
+                raise SingleFlightTimeout(f"timed out waiting for in-flight {self.name} call {key!r}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        self._incr("executed")
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _incr(self, what):
+        if self.metrics:
+            self.metrics.incr(f"singleflight.{self.name}.{what}")
@@ -0,0 +1,221 @@
+"""
+Serving of the built frontend (vite build output in dist/).
+
+Run as a script after `vite build` to write .gz/.br variants next to the
+compressible files:
+
+    python src/backend/static_files.py dist
+
+StaticFiles does the same at startup for anything still missing, so the
+step is optional; doing it at build time just keeps startup fast.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import sys
+import tempfile
+from email.utils import formatdate
+
+from werkzeug.wsgi import FileWrapper
+
+from serialization import negotiate_encoding
+
+try:
+    import brotli
+except ImportError:  # pinned in requirements.txt; gzip alone still works
+    brotli = None
+
+COMPRESSIBLE = {".html", ".js", ".mjs", ".css", ".json", ".map", ".svg", ".txt", ".xml", ".ico", ".webmanifest"}
+MIN_COMPRESS_SIZE = 1024
+
+# Vite content-hashes everything it emits under assets/, so those URLs never change meaning
+IMMUTABLE_PREFIX = "assets/"
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+DEFAULT_CACHE = "public, max-age=3600"
+INDEX_CACHE = "no-cache"
+
+# Preferred first
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+def precompress(root):
+    """Write missing or stale .br/.gz variants for compressible files under root."""
+    written = 0
+    for path in _walk(root):
+        if os.path.splitext(path)[1].lower() not in COMPRESSIBLE:
+            continue
+        if os.path.getsize(path) < MIN_COMPRESS_SIZE:
+            continue
+        mtime = os.path.getmtime(path)
+        data = None
+        for encoding, suffix in ENCODINGS:
+            target = path + suffix
+            if encoding == "br" and brotli is None:
+                continue
+            if os.path.exists(target) and os.path.getmtime(target) >= mtime:
+                continue
+            if data is None:
+                with open(path, "rb") as f:
+                    data = f.read()
+            if encoding == "br":
+                compressed = brotli.compress(data, quality=11)
+            else:
+                compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(compressed) >= len(data):
+                continue
+            # Write beside the target and rename, so a worker scanning at the
+            # same time sees either no variant or a complete one
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".precompress-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(compressed)
+                # mkstemp creates 0600; give the variant the source file's permissions
+                os.chmod(tmp, os.stat(path).st_mode & 0o777)
+                os.replace(tmp, target)
+                written += 1
+            except OSError as e:
+                print(f"Could not write {target}: {e}")
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+    return written
+
+
+def _walk(root):
+    for directory, _, files in os.walk(root):
+        for name in files:
+            if name.endswith((".gz", ".br")) or name.startswith(".precompress-"):
+                continue
+            yield os.path.join(directory, name)
+
+
+class _Variant:
+    __slots__ = ("path", "size", "etag")
+
+    def __init__(self, path, size, etag):
+        self.path = path
+        self.size = size
+        self.etag = etag
+
+
+class _Entry:
+    __slots__ = ("content_type", "cache_control", "last_modified", "variants")
+
+    def __init__(self, content_type, cache_control, last_modified, variants):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.last_modified = last_modified
+        # content-coding ("identity", "br", "gzip") -> _Variant
+        self.variants = variants
+
+
+class StaticFiles:
+    """
+    WSGI middleware that answers GET/HEAD for files in the frontend build
+    before the request reaches Flask.
+
+    The file table (sizes, strong ETags, available encodings, cache policy)
+    is built once at startup, so a request costs a dict lookup plus a
+    sendfile through wsgi.file_wrapper. Unknown non-API paths get index.html
+    so client-side routes keep working; /api/ always goes to the app.
+    """
+
+    def __init__(self, app, root, compress=True, api_prefix="/api/"):
+        self.app = app
+        self.root = os.path.abspath(root)
+        self.api_prefix = api_prefix
+        if compress:
+            precompress(self.root)
+        self.files = self._scan()
+        self.index = self.files.get("index.html")
+
+    def _scan(self):
+        files = {}
+        for path in _walk(self.root):
+            rel = os.path.relpath(path, self.root).replace(os.sep, "/")
+            stat = os.stat(path)
+            with open(path, "rb") as f:
+                digest = hashlib.md5(f.read()).hexdigest()
+            variants = {"identity": _Variant(path, stat.st_size, f'"{digest}"')}
+            for encoding, suffix in ENCODINGS:
+                if os.path.exists(path + suffix):
+                    # Each representation needs its own strong validator
+                    variants[encoding] = _Variant(
+                        path + suffix, os.path.getsize(path + suffix), f'"{digest}-{encoding}"'
+                    )
+            if rel == "index.html":
+                cache_control = INDEX_CACHE
+            elif rel.startswith(IMMUTABLE_PREFIX):
+                cache_control = IMMUTABLE_CACHE
+            else:
+                cache_control = DEFAULT_CACHE
+            content_type = mimetypes.guess_type(rel)[0] or "application/octet-stream"
+            if content_type.startswith("text/") or content_type in ("application/javascript", "application/json"):
+                content_type += "; charset=utf-8"
+            files[rel] = _Entry(content_type, cache_control, formatdate(stat.st_mtime, usegmt=True), variants)
+        return files
+
+    def __call__(self, environ, start_response):
+        method = environ.get("REQUEST_METHOD")
+        path = environ.get("PATH_INFO", "/")
+        if method not in ("GET", "HEAD") or path.startswith(self.api_prefix):
+            return self.app(environ, start_response)
+
+        entry = self.files.get(path.lstrip("/"))
+        if entry is None:
+            if path.startswith("/" + IMMUTABLE_PREFIX):
+                # A missing hashed asset must 404, not turn into index.html
+                start_response("404 Not Found", [("Content-Type", "text/plain"), ("Content-Length", "9")])
+                return [b"Not Found"]
+            if self.index is None:
+                return self.app(environ, start_response)
+            entry = self.index
+        return self._serve(entry, environ, start_response, method == "HEAD")
+
+    def _serve(self, entry, environ, start_response, head_only):
+        variant, encoding = self._negotiate(entry, environ.get("HTTP_ACCEPT_ENCODING", ""))
+        headers = [
+            ("Content-Type", entry.content_type),
+            ("Cache-Control", entry.cache_control),
+            ("ETag", variant.etag),
+            ("Last-Modified", entry.last_modified),
+        ]
+        if len(entry.variants) > 1:
+            headers.append(("Vary", "Accept-Encoding"))
+
+        if _etag_matches(environ.get("HTTP_IF_NONE_MATCH"), variant.etag):
+            start_response("304 Not Modified", [h for h in headers if h[0] != "Content-Type"])
+            return []
+
+        if encoding != "identity":
+            headers.append(("Content-Encoding", encoding))
+        headers.append(("Content-Length", str(variant.size)))
+        start_response("200 OK", headers)
+        if head_only:
+            return []
+        f = open(variant.path, "rb")
+        file_wrapper = environ.get("wsgi.file_wrapper", FileWrapper)
+        # Servers such as gunicorn turn this into sendfile(), so the bytes never enter Python
+        return file_wrapper(f, 64 * 1024)
+
+    def _negotiate(self, entry, accept_encoding):
+        if len(entry.variants) > 1:
+            encoding = negotiate_encoding(
+                accept_encoding, [encoding for encoding, _ in ENCODINGS if encoding in entry.variants]
+            )
+            if encoding:
+                return entry.variants[encoding], encoding
+        return entry.variants["identity"], "identity"
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(candidate.strip().removeprefix("W/") == etag for candidate in header.split(","))
+
+
+if __name__ == "__main__":
+    root = sys.argv[1] if len(sys.argv) > 1 else "dist"
+    print(f"Wrote {precompress(root)} compressed files under {root}")
@@ -0,0 +1,444 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from serialization import dumps
+
+# Returned by Storage.get() when if_none_match equals the stored etag
+NOT_MODIFIED = object()
+
+StoredObject = namedtuple("StoredObject", ["body", "etag"])
+
+
+class StorageError(Exception):
+    """A backend failure. code mirrors the S3 error code where there is one."""
+
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+
+class PreconditionFailed(StorageError):
+    """A conditional put lost: the object changed (or appeared) since it was read."""
+
+    def __init__(self, key):
+        super().__init__(f"Precondition failed for {key}", code="PreconditionFailed")
+
+
+class Storage:
+    """
+    Object storage for everything the app persists, addressed by the same
+    keys the S3 bucket has always used:
+
+        private/{user_id}/users/{user_id}/profile.json
+        private/{user_id}/discussions/{discussion_id}.json
+        private/{user_id}/search/index.json.gz
+        philosopher_data/{philosopher_id}.json
+
+    Backends implement get/put/list/ping; the profile, discussion and
+    philosopher helpers are shared and can be overridden where a backend has
+    a faster way to answer them.
+    """
+
+    name = None
+
+    def get(self, key, if_none_match=None):
+        """StoredObject, None if the key does not exist, or NOT_MODIFIED."""
+        raise NotImplementedError
+
+    def put(self, key, body, content_type="application/json", content_encoding=None,
+            if_match=None, if_none_match=None):
+        """
+        Store body (bytes) under key and return its new etag.
+
+        With if_match the write only happens while the stored etag still
+        equals it; with if_none_match="*" only while the key does not exist.
+        Otherwise PreconditionFailed is raised and nothing is written.
+        """
+        raise NotImplementedError
+
+    def list(self, prefix):
+        """Yield (key, etag) for every key under prefix, in key order."""
+        raise NotImplementedError
+
+    def ping(self):
+        """Cheap round trip to the backend; raises StorageError when unavailable."""
+        raise NotImplementedError
+
+    def url_for(self, key, expires_in=3600):
+        """A URL the browser can fetch key from, if the backend has one."""
+        return None
+
+    # JSON documents
+
+    def get_json(self, key):
+        obj = self.get(key)
+        if obj is None:
+            return None
+        return json.loads(obj.body.decode("utf-8"))
+
+    def put_json(self, key, data):
+        return self.put(key, dumps(data))
+
+    def iter_json(self, prefix, prefetch=8, logger=None):
+        """
+        Yield (key, data) for the .json objects under prefix in key order.
+
+        Up to `prefetch` reads run ahead of the consumer, so at most that many
+        documents are held in memory however many exist.
+        """
+        def fetch(key):
+            try:
+                return self.get_json(key)
+            except (StorageError, json.JSONDecodeError) as e:
+                if logger:
+                    logger.warning(f"Skipping {key}: {e}")
+                return None
+
+        executor = ThreadPoolExecutor(max_workers=prefetch)
+        pending = deque()
+        try:
+            for key, _ in self.list(prefix):
+                if not key.lower().endswith(".json"):
+                    continue
+                pending.append((key, executor.submit(fetch, key)))
+                if len(pending) >= prefetch:
+                    key, future = pending.popleft()
+                    data = future.result()
+                    if data is not None:
+                        yield key, data
+            while pending:
+                key, future = pending.popleft()
+                data = future.result()
+                if data is not None:
+                    yield key, data
+        finally:
+            # The consumer may stop early (e.g. a client disconnects mid-export)
+            for _, future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    # Profiles
+
+    def profile_key(self, user_id):
+        return f"private/{user_id}/users/{user_id}/profile.json"
+
+    def get_profile(self, user_id):
+        return self.get_json(self.profile_key(user_id))
+
+    def put_profile(self, user_id, profile):
+        key = self.profile_key(user_id)
+        self.put_json(key, profile)
+        return key
+
+    # Discussions
+
+    def discussions_prefix(self, user_id):
+        return f"private/{user_id}/discussions/"
+
+    def discussion_key(self, user_id, discussion_id):
+        return f"{self.discussions_prefix(user_id)}{discussion_id}.json"
+
+    def get_discussion(self, user_id, discussion_id):
+        return self.get_json(self.discussion_key(user_id, discussion_id))
+
+    def put_discussion(self, user_id, discussion, body=None):
+        """Store a discussion; body may carry its already-serialized JSON."""
+        key = self.discussion_key(user_id, discussion["id"])
+        if body is None:
+            self.put_json(key, discussion)
+        else:
+            self.put(key, body)
+        return key
+
+    def iter_discussions(self, user_id, prefetch=8, logger=None):
+        """Yield (discussion_id, discussion) for every discussion of a user."""
+        for key, data in self.iter_json(self.discussions_prefix(user_id), prefetch, logger):
+            yield _basename(key), data
+
+    # Philosophers
+
+    philosophers_prefix = "philosopher_data/"
+
+    def philosopher_key(self, philosopher_id):
+        return f"{self.philosophers_prefix}{philosopher_id}.json"
+
+    def list_philosophers(self):
+        """{philosopher_id: etag} for every stored philosopher profile."""
+        return {
+            _basename(key): etag
+            for key, etag in self.list(self.philosophers_prefix)
+            if key.lower().endswith(".json")
+        }
+
+    def get_philosopher(self, philosopher_id):
+        return self.get_json(self.philosopher_key(philosopher_id))
+
+    def put_philosopher(self, philosopher_id, data):
+        key = self.philosopher_key(philosopher_id)
+        self.put_json(key, data)
+        return key
+
+    # Search indexes
+
+    def search_index_key(self, user_id):
+        return f"private/{user_id}/search/index.json.gz"
+
+
+class S3Storage(Storage):
+    name = "s3"
+
+    def __init__(self, bucket, client=None, region=None, ping_timeout=5):
+        if client is None:
+            import boto3
+            from botocore.config import Config
+            client = boto3.client("s3", region_name=region)
+            # Health probes get their own client: one attempt, and connect plus
+            # read together stay within the probe deadline
+            ping_client = boto3.client("s3", region_name=region, config=Config(
+                connect_timeout=ping_timeout / 2,
+                read_timeout=ping_timeout / 2,
+                retries={"total_max_attempts": 1},
+            ))
+        else:
+            ping_client = client
+        self.s3 = client
+        self.ping_client = ping_client
+        self.bucket = bucket
+
+    def get(self, key, if_none_match=None):
+        params = {"Bucket": self.bucket, "Key": key}
+        if if_none_match:
+            params["IfNoneMatch"] = if_none_match
+        try:
+            resp = self.s3.get_object(**params)
+            return StoredObject(resp["Body"].read(), resp.get("ETag"))
+        except Exception as e:
+            code = _s3_error_code(e)
+            if code in ("NoSuchKey", "404"):
+                return None
+            if code in ("304", "NotModified"):
+                return NOT_MODIFIED
+            raise _storage_error(e)
+
+    def put(self, key, body, content_type="application/json", content_encoding=None,
+            if_match=None, if_none_match=None):
+        params = {"Bucket": self.bucket, "Key": key, "Body": body, "ContentType": content_type}
+        if content_encoding:
+            params["ContentEncoding"] = content_encoding
+        if if_match:
+            params["IfMatch"] = if_match
+        if if_none_match:
+            params["IfNoneMatch"] = if_none_match
+        try:
+            resp = self.s3.put_object(**params)
+        except Exception as e:
+            # 409 ConditionalRequestConflict: a concurrent conditional write to the same key
+            if _s3_error_code(e) in ("PreconditionFailed", "412", "ConditionalRequestConflict"):
+                raise PreconditionFailed(key)
+            raise _storage_error(e)
+        return (resp or {}).get("ETag")
+
+    def list(self, prefix):
+        try:
+            paginator = self.s3.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+                for obj in page.get("Contents", []):
+                    yield obj["Key"], obj.get("ETag")
+        except Exception as e:
+            raise _storage_error(e)
+
+    def ping(self):
+        try:
+            self.ping_client.head_bucket(Bucket=self.bucket)
+        except Exception as e:
+            raise _storage_error(e)
+
+    def url_for(self, key, expires_in=3600):
+        return self.s3.generate_presigned_url(
+            ClientMethod="get_object",
+            Params={"Bucket": self.bucket, "Key": key},
+            ExpiresIn=expires_in,
+        )
+
+
+def _s3_error_code(e):
+    response = getattr(e, "response", None)
+    if isinstance(response, dict):
+        return response.get("Error", {}).get("Code")
+    return None
+
+
+def _storage_error(e):
+    if isinstance(e, StorageError):
+        return e
+    return StorageError(str(e), code=_s3_error_code(e))
+
+
+# private/{user_id}/discussions/{id}.json and friends, for the index columns
+_DISCUSSION_KEY = re.compile(r"^private/([^/]+)/discussions/([^/]+)\.json$")
+_PROFILE_KEY = re.compile(r"^private/([^/]+)/users/[^/]+/profile\.json$")
+_SEARCH_KEY = re.compile(r"^private/([^/]+)/search/")
+_PHILOSOPHER_KEY = re.compile(r"^philosopher_data/([^/]+)\.json$")
+
+
+class SQLiteStorage(Storage):
+    """
+    Embedded backend for single-node deployments and tests.
+
+    Objects live in one table keyed by their S3-style key, with user_id, kind
+    and updated_at columns extracted on write so per-user discussion queries
+    use an index instead of a prefix scan.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS objects (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                user_id TEXT,
+                updated_at TEXT,
+                etag TEXT NOT NULL,
+                content_type TEXT,
+                content_encoding TEXT,
+                body BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS objects_user_kind_updated
+                ON objects (user_id, kind, updated_at);
+            CREATE INDEX IF NOT EXISTS objects_updated ON objects (updated_at);
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, if_none_match=None):
+        try:
+            row = self._conn().execute(
+                "SELECT body, etag FROM objects WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            raise StorageError(str(e))
+        if row is None:
+            return None
+        if if_none_match and if_none_match == row[1]:
+            return NOT_MODIFIED
+        return StoredObject(bytes(row[0]), row[1])
+
+    def put(self, key, body, content_type="application/json", content_encoding=None,
+            if_match=None, if_none_match=None):
+        kind, user_id, updated_at = _index_columns(key, body, content_encoding)
+        etag = '"%s"' % hashlib.md5(body).hexdigest()
+        conn = self._conn()
+        try:
+            if if_match or if_none_match:
+                # Check and write under one write lock
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("SELECT etag FROM objects WHERE key = ?", (key,)).fetchone()
+                current = row[0] if row else None
+                if (if_match and current != if_match) or (if_none_match == "*" and current is not None):
+                    conn.execute("ROLLBACK")
+                    raise PreconditionFailed(key)
+            conn.execute(
+                "INSERT OR REPLACE INTO objects"
+                " (key, kind, user_id, updated_at, etag, content_type, content_encoding, body)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, kind, user_id, updated_at, etag, content_type, content_encoding, body),
+            )
+            if conn.in_transaction:
+                conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise StorageError(str(e))
+        return etag
+
+    def list(self, prefix):
+        # A key range instead of LIKE so the primary key index is used
+        try:
+            rows = self._conn().execute(
+                "SELECT key, etag FROM objects WHERE key >= ? AND key < ? ORDER BY key",
+                (prefix, prefix + "\U0010ffff"),
+            ).fetchall()
+        except sqlite3.Error as e:
+            raise StorageError(str(e))
+        return iter(rows)
+
+    def ping(self):
+        try:
+            self._conn().execute("SELECT 1").fetchone()
+        except sqlite3.Error as e:
+            raise StorageError(str(e))
+
+    def iter_discussions(self, user_id, prefetch=8, logger=None):
+        # Newest first, straight off the (user_id, kind, updated_at) index
+        try:
+            cursor = self._conn().execute(
+                "SELECT key, body FROM objects WHERE user_id = ? AND kind = 'discussion'"
+                " ORDER BY updated_at DESC",
+                (user_id,),
+            )
+            # Rows are fetched lazily, so errors can also surface mid-iteration
+            for key, body in cursor:
+                try:
+                    yield _basename(key), json.loads(bytes(body).decode("utf-8"))
+                except json.JSONDecodeError as e:
+                    if logger:
+                        logger.warning(f"Skipping {key}: {e}")
+        except sqlite3.Error as e:
+            raise StorageError(str(e))
+
+
+def _index_columns(key, body, content_encoding):
+    match = _DISCUSSION_KEY.match(key)
+    if match:
+        updated_at = None
+        if not content_encoding:
+            try:
+                updated_at = json.loads(body).get("updatedAt")
+            except (ValueError, AttributeError):
+                pass
+        return "discussion", match.group(1), updated_at
+    match = _PROFILE_KEY.match(key)
+    if match:
+        return "profile", match.group(1), None
+    match = _SEARCH_KEY.match(key)
+    if match:
+        return "search_index", match.group(1), None
+    if _PHILOSOPHER_KEY.match(key):
+        return "philosopher", None, None
+    return "object", None, None
+
+
+def _basename(key):
+    name = os.path.basename(key)
+    return name[:-len(".json")] if name.lower().endswith(".json") else name
+
+
+def create_storage(backend=None):
+    """Build the backend selected by STORAGE_BACKEND (s3 or sqlite)."""
+    backend = (backend or os.getenv("STORAGE_BACKEND", "s3")).lower()
+    if backend == "s3":
+        return S3Storage(
+            os.getenv("S3_BUCKET", "philo-ai"),
+            region=os.getenv("AWS_DEFAULT_REGION", "us-east-1"),
+            ping_timeout=float(os.getenv("HEALTH_PROBE_TIMEOUT_SECONDS", "5")),
+        )
+    if backend == "sqlite":
+        return SQLiteStorage(os.getenv("SQLITE_PATH", os.path.join(os.path.dirname(__file__), "philo.db")))
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
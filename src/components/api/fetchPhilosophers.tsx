@@ -12,7 +12,7 @@ interface Philosopher {
 export type JsonContents = Record<string, Philosopher>;
 export async function fetchPhilosophers(): Promise<JsonContents> {
   try {
-    const res = await fetch("/api/get/folder?prefix=philosopher_data", {
+    const res = await fetch("/api/philosophers/", {
       method: 'GET',
       headers: {
         'Accept': 'application/json'
@@ -199,6 +199,26 @@ export async function getUserDiscussions(identityId: string): Promise<Discussion
   console.log('Mapped discussions:', mappedDiscussions);
   return mappedDiscussions;
 }
+export interface DiscussionSearchHit {
+  id: string;
+  title: string;
+  updatedAt: string;
+  philosopherName: string;
+  score: number;
+}
+export async function searchDiscussions(identityId: string, query: string, limit = 20): Promise<DiscussionSearchHit[]> {
+  const params = new URLSearchParams({ id: identityId, q: query, limit: String(limit) });
+  const res = await fetch(`/api/search/discussions/?${params}`, {
+    method: 'GET',
+    headers: { 'Accept': 'application/json' }
+  });
+
+  if (!res.ok) {
+    throw new Error(`Failed to search discussions: ${res.status}`);
+  }
+  const { results } = await res.json() as { results: DiscussionSearchHit[] };
+  return results;
+}
 export async function sendMessage(discussionId: string, message: Message, currDiscussion: Discussion) {
   try {
     const session = await fetchAuthSession();